@@ -1,37 +1,106 @@
-from flask import Flask, render_template, jsonify
-import json
+from flask import Flask, render_template, jsonify, make_response, request
+from flask.json.provider import DefaultJSONProvider
 import os
+import threading
+
+# Prefer orjson for the status.json read path; fall back to the stdlib parser
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    import json as orjson
+    HAVE_ORJSON = False
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Routes jsonify() through orjson; Flask's default handler covers anything orjson can't encode."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
 
 app = Flask(__name__)
+if HAVE_ORJSON:
+    app.json = OrjsonProvider(app)
 STATUS_FILE = "status.json"
+# The bot only rewrites status.json every 5 minutes, so let clients reuse responses briefly
+CACHE_CONTROL = "max-age=30, stale-while-revalidate=60"
+
+# In-memory copy of status.json, refreshed only when the file's mtime changes
+_STATUS_CACHE = None
+_STATUS_MTIME = 0
+_STATUS_LOCK = threading.Lock()
+
+def load_status():
+    """Returns the parsed status file, re-reading it only after the bot rewrites it."""
+    global _STATUS_CACHE, _STATUS_MTIME
+    mtime = os.stat(STATUS_FILE).st_mtime_ns  # raises FileNotFoundError if missing
+    if mtime == _STATUS_MTIME and _STATUS_CACHE is not None:
+        return _STATUS_CACHE
+    with _STATUS_LOCK:
+        # Another thread may have refreshed the cache while we waited
+        if mtime != _STATUS_MTIME or _STATUS_CACHE is None:
+            with open(STATUS_FILE, 'rb') as f:
+                _STATUS_CACHE = orjson.loads(f.read())
+            _STATUS_MTIME = mtime
+        return _STATUS_CACHE
+
+def status_etag():
+    """Builds an ETag from the status file's mtime, or None if the file doesn't exist yet."""
+    try:
+        return '%x' % os.stat(STATUS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def not_modified(etag):
+    """True when the client already holds the response for this ETag."""
+    # If-None-Match uses weak comparison and may list several tags (or "*")
+    return etag is not None and request.if_none_match.contains_weak(etag)
+
+def with_cache_headers(resp, etag):
+    if etag is not None:
+        resp.headers["Cache-Control"] = CACHE_CONTROL
+        resp.set_etag(etag)
+    return resp
 
 @app.route('/')
 def index():
     """Renders the main dashboard page, reading data from the status file."""
+    etag = status_etag()
+    if not_modified(etag):
+        # A 304 repeats the validators so caches can refresh their stored copy
+        return with_cache_headers(make_response("", 304), etag)
+
     try:
         # Load the status data saved by space_alert_bot.py
         if os.path.exists(STATUS_FILE):
-            with open(STATUS_FILE, 'r') as f:
-                status = json.load(f)
+            status = load_status()
         else:
             # Default state if the backend hasn't run yet
             status = {"risk": "INITIALIZING", "kp_value": "N/A", "flare_class": "N/A", "cme_speed": "N/A", "time": "No Data"}
     except Exception:
-        # State if the file is corrupted
+        # State if the file is corrupted; don't let clients cache it
         status = {"risk": "ERROR", "kp_value": "N/A", "flare_class": "N/A", "cme_speed": "N/A", "time": "Error Reading Data"}
+        etag = None
         
     # Passes the status data to the HTML template for display
-    return render_template('dashboard.html', status=status)
+    resp = make_response(render_template('dashboard.html', status=status))
+    return with_cache_headers(resp, etag)
 
 @app.route('/data')
 def get_data():
+    etag = status_etag()
+    if not_modified(etag):
+        # A 304 repeats the validators so caches can refresh their stored copy
+        return with_cache_headers(make_response("", 304), etag)
+
     try:
-        with open(STATUS_FILE, 'r') as f:
-            status = json.load(f)
-            return jsonify(status)
+        status = load_status()
+        return with_cache_headers(jsonify(status), etag)
     except FileNotFoundError:
         return jsonify({"error": "No data file found"}), 404
 
 if __name__ == '__main__':
+    # Development server only; debug mode is opt-in via FLASK_DEBUG=1.
+    # In production serve through a WSGI server instead, e.g.
+    #   gunicorn -w 4 -k gthread --threads 4 app:app --bind 0.0.0.0:8000
+    debug = os.getenv("FLASK_DEBUG", "").lower() in ("1", "true", "yes")
     # Running on port 8000 for better compatibility
-    app.run(debug=True, use_reloader=False, port=8000)
+    app.run(debug=debug, use_reloader=False, port=8000)
@@ -1,11 +1,27 @@
 # space_alert_bot.py
 # FINAL CODE: Fetches NOAA Kp, NASA Flares, and NASA CME data, calculates risk, and sends WhatsApp alerts.
 
-import requests, time, json, os
+import requests, os, tempfile, threading
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FetchTimeoutError
 from datetime import datetime, timezone
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from dotenv import load_dotenv
-import schedule 
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+# Prefer orjson (faster, writes bytes directly); fall back to the stdlib encoder
+try:
+    import orjson
+
+    def dump_json(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    import json as orjson
+
+    def dump_json(obj):
+        return orjson.dumps(obj, indent=2).encode("utf-8")
 
 # --- Initialization ---
 load_dotenv()  # Load keys from the .env file
@@ -15,6 +31,15 @@ TWILIO_SID = os.getenv("TWILIO_SID")
 TWILIO_AUTH = os.getenv("TWILIO_AUTH")
 TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM")
 TWILIO_TO = os.getenv("TWILIO_TO")
+# Give up on a Twilio send after this many seconds, so a hung call can't hold an
+# EXECUTOR worker (shared with the API fetches) forever
+TWILIO_TIMEOUT = 30
+# Built once so every alert reuses Twilio's HTTP connection pool
+# (Client() refuses to construct without credentials, so defer that error to send time)
+TWILIO_CLIENT = (
+    Client(TWILIO_SID, TWILIO_AUTH, http_client=TwilioHttpClient(timeout=TWILIO_TIMEOUT))
+    if TWILIO_SID and TWILIO_AUTH else None
+)
 
 NASA_API_KEY = os.getenv("NASA_API_KEY")
 CACHE_FILE = "last_alert_cache.json"
@@ -25,6 +50,39 @@ NOAA_KP_URL = "https://services.swpc.noaa.gov/json/planetary_k_index_1m.json"
 NASA_FLARE_URL = f"https://api.nasa.gov/DONKI/FLR?api_key={NASA_API_KEY}" 
 NASA_CME_URL = f"https://api.nasa.gov/DONKI/CMEAnalysis?api_key={NASA_API_KEY}" 
 
+# (connect, read) timeouts: a slow handshake can't eat the whole budget for the payload
+HTTP_TIMEOUT = (3.05, 10)
+# Retry transient server errors with a short backoff; ignore Retry-After, which
+# urllib3 would otherwise honour with no upper bound
+HTTP_RETRY = Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                   allowed_methods=("GET",), respect_retry_after_header=False)
+# How long check_and_alert waits on each fetch (~44s). A heuristic, not a hard bound:
+# the read timeout applies per socket read, so a slowly trickling body can run longer.
+FETCH_TIMEOUT = (HTTP_RETRY.total + 1) * sum(HTTP_TIMEOUT) + 5
+
+# Shared HTTP session so NOAA/NASA keep-alive connections are reused across ticks.
+# With requests-cache installed, DONKI lists (which change a few times an hour) are
+# served from memory for 5 minutes; NOAA Kp is always revalidated with the server.
+try:
+    from requests_cache import CachedSession
+    SESSION = CachedSession(
+        "donki_cache",
+        backend="memory",
+        expire_after=0,
+        urls_expire_after={"api.nasa.gov": 300},
+        allowable_methods=("GET",)
+    )
+except ImportError:
+    SESSION = requests.Session()
+for _prefix in ("https://services.swpc.noaa.gov/", "https://api.nasa.gov/"):
+    SESSION.mount(_prefix, HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=HTTP_RETRY))
+
+# Worker pool for the independent NOAA/NASA fetches
+EXECUTOR = ThreadPoolExecutor(max_workers=3)
+
+# Last-Modified/ETag validators and parsed payload per URL, for conditional GETs
+HTTP_CACHE = {}
+
 
 # --- Localization phrases (for WhatsApp message content) ---
 PHRASES = {
@@ -48,25 +106,91 @@ PHRASES = {
     }
 }
 
+# --- Precomputed message skeletons (only time, Kp and extras vary per alert) ---
+def _build_templates(p):
+    def esc(text):
+        return text.replace("{", "{{").replace("}", "}}")
+
+    when_line = esc(p["when"]) + ": {t} (Kp={kp}){extras}"
+    return {
+        "red": "\n".join([esc(p["title_red"]), when_line,
+                          esc(p["gps_advice"]), esc(p["power_advice"]), esc(p["flare_risk"])]),
+        "yellow": "\n".join([esc(p["title_yellow"]), when_line, esc(p["gps_advice"])]),
+        "yellow_flare": "\n".join([esc(p["title_yellow"]), when_line,
+                                   esc(p["gps_advice"]), esc(p["flare_risk"])]),
+        "green": "\n".join([esc(p["title_green"]), when_line, "No immediate action needed."]),
+    }
+
+TEMPLATES = {lang: _build_templates(p) for lang, p in PHRASES.items()}
+
 # --- Utilities ---
 def load_cache():
     if os.path.exists(CACHE_FILE):
         try:
-            return json.load(open(CACHE_FILE, "r"))
-        except:
+            with open(CACHE_FILE, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, ValueError):  # ValueError covers JSON and UTF-8 decode errors
             return {}
     return {}
 
+def write_json_atomic(path, obj):
+    """Writes JSON to a temp file and swaps it in, so readers never see a half-written file."""
+    # Unique temp name, so two writers can never truncate each other's temp file
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + ".",
+        suffix=".tmp",
+        delete=False
+    ) as f:
+        f.write(dump_json(obj))
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.remove(f.name)
+        raise
+
 def save_cache(d):
-    json.dump(d, open(CACHE_FILE, "w"), indent=2)
+    write_json_atomic(CACHE_FILE, d)
+
+# This process owns the alert cache, so read it once and keep it in memory;
+# it's only written back to disk when an alert changes it.
+_CACHE = load_cache()
+# Guards _CACHE and its save: ticks and the send callback run on different threads
+_CACHE_LOCK = threading.Lock()
 
 # --- Data Fetching Functions ---
 
+def get_json(url):
+    """GETs a JSON endpoint, reusing the previous payload when the server answers 304."""
+    cached = HTTP_CACHE.get(url)
+    headers = {}
+    if cached:
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+
+    r = SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    if r.status_code == 304 and cached:
+        return cached["payload"]
+    r.raise_for_status()
+    try:
+        payload = orjson.loads(r.content)
+    except ValueError as e:
+        # Keep surfacing bad bodies as a RequestException, as r.json() did
+        raise requests.exceptions.InvalidJSONError(e, response=r)
+
+    last_modified = r.headers.get("Last-Modified")
+    etag = r.headers.get("ETag")
+    if last_modified or etag:
+        HTTP_CACHE[url] = {"last_modified": last_modified, "etag": etag, "payload": payload}
+    return payload
+
 def fetch_latest_kp():
     """Fetches the latest Kp index from NOAA."""
-    r = requests.get(NOAA_KP_URL, timeout=15)
-    r.raise_for_status()
-    arr = r.json()
+    arr = get_json(NOAA_KP_URL)
     if not arr:
         return None
     
@@ -83,12 +207,13 @@ def fetch_latest_kp():
 
 def fetch_latest_nasa_flare():
     """Fetches the latest solar flare data from NASA DONKI."""
+    if not NASA_API_KEY:
+        return None # No key configured; don't burn the tick on a request that will fail
+    
     url = NASA_FLARE_URL 
     
     try:
-        r = requests.get(url, timeout=15)
-        r.raise_for_status()
-        flares = r.json()
+        flares = get_json(url)
         
         if not flares:
             return None 
@@ -105,24 +230,27 @@ def fetch_latest_nasa_flare():
 
 def fetch_latest_cme():
     """Fetches the latest Coronal Mass Ejection (CME) data from NASA DONKI."""
+    if not NASA_API_KEY:
+        return None # No key configured; don't burn the tick on a request that will fail
+    
     url = NASA_CME_URL 
     
     try:
-        r = requests.get(url, timeout=15)
-        r.raise_for_status()
-        cme_analyses = r.json()
+        cme_analyses = get_json(url)
         
         if not cme_analyses:
             return None 
             
-        for analysis in cme_analyses:
-            is_most_accurate = analysis.get("isMostAccurate")
-            speed = analysis.get("speed")
+        # First most-accurate analysis faster than 600 km/s (speed may be null)
+        hit = next(
+            (a for a in cme_analyses
+             if a.get("isMostAccurate") and (a.get("speed") or 0) > 600),
+            None
+        )
+        if hit is None:
+            return None # No significant, earth-directed CME found
             
-            if is_most_accurate and speed and speed > 600:
-                return {"speed": speed, "raw": analysis}
-                
-        return None # No significant, earth-directed CME found
+        return {"speed": hit["speed"], "raw": hit}
         
     except requests.exceptions.RequestException as e:
         print(f"Error fetching NASA CME data: {e}")
@@ -169,95 +297,111 @@ def score_risk(kp_value, flare_class=None, cme_speed=None):
 # --- Message Formatting and Sending ---
 
 def format_message(risk, kp_val, time_str, flare_class=None, cme_speed=None, lang="en"): 
-    p = PHRASES.get(lang, PHRASES["en"])
-    
-    if risk == "red":
-        title = p["title_red"]
-    elif risk == "yellow":
-        title = p["title_yellow"]
-    else:
-        title = p["title_green"]
-
-    body_lines = [
-        f"{title}",
-        f"{p['when']}: {time_str} (Kp={kp_val})"
-    ]
+    templates = TEMPLATES.get(lang, TEMPLATES["en"])
     
+    key = risk if risk in ("red", "yellow") else "green"
+    if key == "yellow" and (flare_class == 'M' or cme_speed):
+        key = "yellow_flare"
+
+    extras = ""
     if flare_class and flare_class in ('X', 'M'):
-        body_lines[-1] += f" | Flare Class: {flare_class}"
+        extras += f" | Flare Class: {flare_class}"
     
     if cme_speed:
-        body_lines[-1] += f" | CME Speed: {cme_speed} km/s"
-        
-    if risk == "red":
-        body_lines.append(p["gps_advice"])
-        body_lines.append(p["power_advice"])
-        body_lines.append(p["flare_risk"]) 
-            
-    elif risk == "yellow":
-        body_lines.append(p["gps_advice"])
-        if flare_class == 'M' or cme_speed:
-            body_lines.append(p["flare_risk"])
-    else:
-        body_lines.append("No immediate action needed.")
+        extras += f" | CME Speed: {cme_speed} km/s"
 
-    return "\n".join(body_lines)
+    return templates[key].format(t=time_str, kp=kp_val, extras=extras)
 
 def send_whatsapp(message):
-    client = Client(TWILIO_SID, TWILIO_AUTH)
-    msg = client.messages.create(
+    if TWILIO_CLIENT is None:
+        raise RuntimeError("TWILIO_SID/TWILIO_AUTH are not set")
+    return TWILIO_CLIENT.messages.create(
         body=message,
         from_=TWILIO_WHATSAPP_FROM,
         to=TWILIO_TO
-    )
-    return msg.sid
+    ).sid
+
+def _persist_sid(future, previous_cache, token):
+    """Records the real Twilio sid once the background send finishes.
+
+    ``token`` is the ``last_sent_at`` value written when this send was queued; if a
+    later tick has queued another alert since, this result is stale and is dropped.
+    """
+    try:
+        sid = future.result()
+    except Exception as e:
+        print("Error sending alert:", e)
+        with _CACHE_LOCK:
+            if _CACHE.get("last_sent_at") != token:
+                return  # a newer alert owns the cache now; don't roll it back
+            # Roll the cache back so the next tick retries the alert
+            _CACHE.clear()
+            _CACHE.update(previous_cache)
+            save_cache(_CACHE)
+        return
+
+    with _CACHE_LOCK:
+        if _CACHE.get("last_sent_at") != token:
+            print("Sent (superseded by a newer alert):", sid)
+            return
+
+        print("Sent:", sid, "Risk:", _CACHE.get("last_risk"))
+        _CACHE["last_sent_sid"] = sid
+        save_cache(_CACHE)
 
 # --- Main check function ---
 def check_and_alert():
     try:
+        # Fire all three requests at once; they are independent of each other
+        f_kp = EXECUTOR.submit(fetch_latest_kp)
+        f_fl = EXECUTOR.submit(fetch_latest_nasa_flare)
+        f_cme = EXECUTOR.submit(fetch_latest_cme)
+
         # 1. Fetch NOAA Kp Data
-        kp_data = fetch_latest_kp()
+        kp_data = f_kp.result(timeout=FETCH_TIMEOUT)
         if not kp_data:
             print("No NOAA Kp data")
             return
 
         kp = kp_data["kp"]
-        t = kp_data["time"] or datetime.now(timezone.utc).isoformat()
         
         # 2. Fetch NASA Flare Data 
-        flare_data = fetch_latest_nasa_flare()
+        flare_data = f_fl.result(timeout=FETCH_TIMEOUT)
         flare_class = flare_data['class'] if flare_data else None
 
         # 3. Fetch NASA CME Data (NEW STEP)
-        cme_data = fetch_latest_cme()
+        cme_data = f_cme.result(timeout=FETCH_TIMEOUT)
         cme_speed = cme_data['speed'] if cme_data else None
+
+        # One clock read per tick, once all fetches are in; every timestamp below is derived from it
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        now_clean = now.strftime("%Y-%m-%d %H:%M:%S UTC")
+        t = kp_data["time"] or now_iso
         
         # 4. Score Risk using ALL three sources (UPDATED CALL)
         risk = score_risk(kp, flare_class, cme_speed) 
 
-        cache = load_cache()
-        last = cache.get("last_kp")
+        with _CACHE_LOCK:
+            last = _CACHE.get("last_kp")
+            last_risk = _CACHE.get("last_risk")
         
         should_send = False
-        if not last or risk != cache.get("last_risk"):
+        if not last or risk != last_risk:
             should_send = True
 
         # --- Dashboard/Cache Saving Logic ---
         
-        # 1. Create a clean, readable timestamp 
-        clean_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-        
         current_status = {
             "risk": risk,
             "kp_value": kp,
             "flare_class": flare_class,
             "cme_speed": cme_speed,
-            "time": clean_time 
+            "time": now_clean 
         }
         
         # Save current status to a file for the web dashboard (app.py)
-        with open("status.json", "w") as f:
-            json.dump(current_status, f, indent=2)
+        write_json_atomic("status.json", current_status)
         # --- End Dashboard/Cache Saving Logic ---
 
 
@@ -266,33 +410,54 @@ def check_and_alert():
             msg_ml = format_message(risk, kp, t, flare_class, cme_speed, lang="ml") 
             
             full_msg = f"{msg_en}\n\n---\n{msg_ml}"
-            sid = send_whatsapp(full_msg)
-            
-            print("Sent:", sid, "Risk:", risk)
-            # Update cache only after sending the message
-            cache["last_kp"] = kp
-            cache["last_time"] = t
-            cache["last_risk"] = risk
-            cache["last_sent_sid"] = sid
-            cache["last_sent_at"] = datetime.now(timezone.utc).isoformat()
-            save_cache(cache)
+            # Record the alert before queueing it, so the callback always sees its token.
+            # The real sid is filled in by _persist_sid when the send completes.
+            with _CACHE_LOCK:
+                previous_cache = dict(_CACHE)
+                _CACHE["last_kp"] = kp
+                _CACHE["last_time"] = t
+                _CACHE["last_risk"] = risk
+                _CACHE["last_sent_sid"] = "pending"
+                _CACHE["last_sent_at"] = now_iso
+                save_cache(_CACHE)
+
+            # Send in the background so the tick isn't held up by Twilio. Kept outside
+            # the lock: add_done_callback runs inline if the send has already finished.
+            fut = EXECUTOR.submit(send_whatsapp, full_msg)
+            print("Queued alert. Risk:", risk)
+            fut.add_done_callback(lambda f: _persist_sid(f, previous_cache, now_iso))
         else:
             print(f"No alert (no change). Kp: {kp}, Flare: {flare_class}, CME Speed: {cme_speed} km/s") 
             
+    except FetchTimeoutError:
+        print(f"Error in check: API fetch took longer than {FETCH_TIMEOUT:.0f}s")
     except Exception as e:
         print("Error in check:", e)
 
 # --- Run as loop for demo; in production use scheduler (cron) ---
 if __name__ =="__main__":
+    if not NASA_API_KEY:
+        print("NASA_API_KEY not set - skipping NASA flare/CME checks (Kp only).")
+
     # 1. Run immediately on startup
     check_and_alert()
     
-    # 2. Schedule checks every 5 minutes
-    schedule.every(5).minutes.do(check_and_alert)
+    # 2. Schedule checks every 5 minutes. coalesce collapses runs missed while the
+    #    machine was asleep into one, and misfire_grace_time=None lets that late run
+    #    actually fire (APScheduler otherwise drops runs more than 1s late);
+    #    max_instances stops a slow tick from overlapping.
+    scheduler = BlockingScheduler()
+    scheduler.add_job(check_and_alert, "interval", minutes=5, max_instances=1, coalesce=True,
+                      misfire_grace_time=None)
     
     print("\n--- Starting Continuous Monitoring Loop ---")
     print("Checking for space weather updates every 5 minutes...")
     
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if scheduler.running:
+            scheduler.shutdown()
+        EXECUTOR.shutdown(wait=True)  # let any in-flight alert finish sending